@@ -15,16 +15,25 @@ Behavior:
 - Uses hardware encoder if test passes (vaapi, rkmpp, v4l2m2m)
 """
 
+import argparse
+import functools
+import hashlib
+import json
 import os
 import re
+import shlex
 import sys
 import subprocess
-from collections import defaultdict
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
 from ruamel.yaml import YAML
 from pathlib import Path
 
 # Config path relative to this script (scripts/) → ../mediamtx/mediamtx.yml
 CONFIG_PATH = Path(__file__).resolve().parent.parent / "mediamtx" / "mediamtx.yml"
+# JSON sidecar with {cam_id: rtsp_url}, read by snapfeeder instead of the YAML
+SIDECAR_PATH = CONFIG_PATH.parent / "mediamtx_paths.json"
 PREFERRED_RES = "1280x720"
 FORMAT_PRIORITY = ["mjpeg", "h264", "nv12", "yuv420", "yuyv422", "rawvideo"]
 FORMAT_ALIASES = {
@@ -38,7 +47,22 @@ FORMAT_ALIASES = {
 FLAGS_ON = ["rtsp", "webrtc", "hls"]
 FLAGS_OFF = ["rtmp", "api", "metrics", "pprof", "playback", "srt"]
 
+# Cached v4l2-ctl outputs, keyed by a hash of the device's sysfs identity
+CACHE_PATH = Path("/var/cache/mtx-stream-snap/v4l2.json")
+CACHE_TTL = 24 * 3600  # seconds
+
+# Precompiled patterns for v4l2-ctl output and /dev/video* names.
+# The combined alternation lets parse_formats scan the whole output in a
+# single finditer pass; match.lastgroup tags which production hit.
+_RE_ANY = re.compile(
+    r"\[\d+\]: '(?P<fmt>\w+)'"
+    r"|Size: Discrete (?P<size>\d+x\d+)"
+    r"|Interval: Discrete \d+\.\d+s \((?P<ival>[\d\.]+) fps\)"
+)
+
+@functools.cache
 def list_available_hwaccels():
+    """Lazily probes `ffmpeg -hwaccels` on first use; cached per process."""
     try:
         result = subprocess.run(
             ["ffmpeg", "-hide_banner", "-hwaccels"],
@@ -49,75 +73,96 @@ def list_available_hwaccels():
     except Exception:
         return []
 
-AVAILABLE_HWACCELS = list_available_hwaccels()
 
-
-def has_vaapi_encoder():
+@functools.cache
+def _probe_encoders():
     """
-    Checks whether VAAPI hardware encoder (h264_vaapi) is available
-    by running a test FFmpeg command using synthetic input.
+    Runs `ffmpeg -encoders` on first use and returns the set of video
+    encoder names. One cheap fork replaces the previous per-encoder test
+    encodes, and --help / dry imports never pay for it.
     """
     try:
-        test_cmd = [
-            "ffmpeg", "-hide_banner",
-            "-f", "lavfi", "-i", "testsrc2=size=128x128:rate=5",
-            "-frames:v", "1",
-            "-vaapi_device", "/dev/dri/renderD128",
-            "-vf", "format=nv12,hwupload",
-            "-c:v", "h264_vaapi",
-            "-f", "null", "-"
-        ]
-        result = subprocess.run(test_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        return result.returncode == 0
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            capture_output=True, text=True
+        )
+        return frozenset(
+            line.split()[1] for line in result.stdout.splitlines()
+            if line.startswith(" V") and len(line.split()) >= 2
+        )
     except Exception:
-        return False
+        return frozenset()
+
+
+def has_vaapi_encoder():
+    """Checks whether the VAAPI hardware encoder (h264_vaapi) is built into ffmpeg."""
+    return "h264_vaapi" in _probe_encoders()
 
 def has_rkmpp_encoder():
-    """
-    Checks whether Rockchip MPP encoder (h264_rkmpp) is available
-    by running a test FFmpeg command with synthetic input and nv12 format.
-    """
-    try:
-        test_cmd = [
-            "ffmpeg", "-hide_banner",
-            "-f", "lavfi", "-i", "testsrc2=size=128x128:rate=5",
-            "-frames:v", "1",
-            "-pix_fmt", "nv12",
-            "-c:v", "h264_rkmpp",
-            "-f", "null", "-"
-        ]
-        result = subprocess.run(test_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        return result.returncode == 0
-    except Exception:
-        return False
+    """Checks whether the Rockchip MPP encoder (h264_rkmpp) is built into ffmpeg."""
+    return "h264_rkmpp" in _probe_encoders()
 
 def has_v4l2m2m_encoder():
+    """Checks whether the V4L2 M2M encoder (h264_v4l2m2m) is built into ffmpeg."""
+    return "h264_v4l2m2m" in _probe_encoders()
+
+# Deep-probe table: per-encoder ffmpeg args for a real test encode
+_PROBES = {
+    "vaapi": (["-vaapi_device", "/dev/dri/renderD128",
+               "-vf", "format=nv12,hwupload"], "h264_vaapi"),
+    "rkmpp": (["-pix_fmt", "nv12"], "h264_rkmpp"),
+    "v4l2m2m": (["-pix_fmt", "yuv420p"], "h264_v4l2m2m"),
+}
+
+def _probe_cmd(name):
+    """Builds the test-encode ffmpeg command for one _PROBES entry."""
+    extra_args, encoder = _PROBES[name]
+    return [
+        "ffmpeg", "-hide_banner",
+        "-f", "lavfi", "-i", "testsrc2=size=128x128:rate=5",
+        "-frames:v", "1",
+        *extra_args,
+        "-c:v", encoder,
+        "-f", "null", "-"
+    ]
+
+def deep_probe_all(names):
     """
-    Checks whether V4L2 M2M encoder (h264_v4l2m2m) is available
-    by running a test FFmpeg command with synthetic input and yuv420p format.
+    Runs the test encodes for the given encoders inside a single `sh -c`
+    invocation — one Python subprocess round-trip instead of one per
+    encoder — and returns {name: succeeded}. Catches hosts where an
+    encoder is listed yet driver init fails at runtime.
     """
+    names = [name for name in names if name in _PROBES]
+    if not names:
+        return {}
+
+    script = "; ".join(
+        " ".join(shlex.quote(arg) for arg in _probe_cmd(name))
+        + " >/dev/null 2>&1; printf '%d\\n' $?"
+        for name in names
+    )
     try:
-        test_cmd = [
-            "ffmpeg", "-hide_banner",
-            "-f", "lavfi", "-i", "testsrc2=size=128x128:rate=5",
-            "-frames:v", "1",
-            "-c:v", "h264_v4l2m2m",
-            "-pix_fmt", "yuv420p",
-            "-f", "null", "-"
-        ]
-        result = subprocess.run(test_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        return result.returncode == 0
+        out = subprocess.check_output(["sh", "-c", script], text=True)
+        codes = out.split()
+        return {name: codes[i] == "0" for i, name in enumerate(names)}
     except Exception:
-        return False
+        return {name: False for name in names}
 
 def list_video_devices():
     """
     Lists all available video input devices in /dev that match /dev/video*.
-    Returns a sorted list of full paths like ['/dev/video0', '/dev/video1', ...].
+    Returns full paths like ['/dev/video0', '/dev/video1', ...] sorted by
+    device index (so video10 sorts after video2).
     """
-    return sorted([
-        f"/dev/{d}" for d in os.listdir("/dev") if re.match(r"video\d+", d)
-    ])
+    with os.scandir("/dev") as entries:
+        devices = [
+            (int(entry.name[5:]), entry.path)
+            for entry in entries
+            if entry.name.startswith("video") and entry.name[5:].isdigit()
+        ]
+    devices.sort()
+    return [path for _, path in devices]
 
 def run_v4l2ctl(device):
     """
@@ -132,37 +177,73 @@ def run_v4l2ctl(device):
     except Exception:
         return None
 
+def v4l2_cache_key(device):
+    """
+    Computes a cache key for a video device from its sysfs name, modalias
+    and device number, so a replugged or different camera never reuses a
+    stale entry. Returns None if the identity cannot be read.
+    """
+    sys_dir = Path("/sys/class/video4linux") / Path(device).name
+    try:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update((sys_dir / "name").read_bytes())
+        modalias = sys_dir / "device" / "modalias"
+        if modalias.exists():
+            digest.update(modalias.read_bytes())
+        digest.update(f"{device}:{os.stat(device).st_rdev}".encode())
+        return digest.hexdigest()
+    except Exception:
+        return None
+
+def load_v4l2_cache():
+    """Loads cached v4l2-ctl outputs, returning an empty dict on any failure."""
+    try:
+        with CACHE_PATH.open("r") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def save_v4l2_cache(cache):
+    """Persists the probe cache, ignoring failures (e.g. read-only /var)."""
+    try:
+        CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with CACHE_PATH.open("w") as f:
+            json.dump(cache, f)
+    except Exception:
+        pass
+
 def parse_formats(v4l2_output):
     """
     Parses the output of `v4l2-ctl --list-formats-ext` and returns
-    a nested dictionary:
-        { format: { resolution: [fps, ...] } }
+    a nested dictionary keeping only the highest frame rate per size:
+        { format: { resolution: max_fps } }
     """
-    formats = defaultdict(lambda: defaultdict(list))
+    formats = {}
     current_format = None
     current_res = None
 
-    for line in v4l2_output.splitlines():
-        line = line.strip()
+    for match in _RE_ANY.finditer(v4l2_output):
+        kind = match.lastgroup
+        value = match.group(kind)
 
-        match = re.match(r"\[\d+\]: '(\w+)'", line)
-        if match:
-            raw = match.group(1).lower()
+        if kind == "fmt":
+            raw = value.lower()
             current_format = FORMAT_ALIASES.get(raw, raw)
-            continue
-
-        match = re.match(r"Size: Discrete (\d+x\d+)", line)
-        if match and current_format:
-            current_res = match.group(1)
-            continue
-
-        match = re.match(r"Interval: Discrete \d+\.\d+s \(([\d\.]+) fps\)", line)
-        if match and current_format and current_res:
-            fps = round(float(match.group(1)))
-            formats[current_format][current_res].append(fps)
+        elif kind == "size":
+            if current_format:
+                current_res = value
+        elif current_format and current_res:
+            fps = round(float(value))
+            resolutions = formats.setdefault(current_format, {})
+            if fps > resolutions.get(current_res, 0):
+                resolutions[current_res] = fps
 
     return formats
 
+def _resolution_key(res):
+    """Turns 'WxH' into a (W, H) tuple for numeric comparison."""
+    return tuple(map(int, res.split('x')))
+
 def select_best_format(formats_by_type):
     """
     Selects the best available format-resolution-FPS combination
@@ -177,9 +258,9 @@ def select_best_format(formats_by_type):
         resolutions = formats_by_type[fmt]
         resolution = (
             PREFERRED_RES if PREFERRED_RES in resolutions else
-            sorted(resolutions, key=lambda r: tuple(map(int, r.split('x'))), reverse=True)[0]
+            max(resolutions, key=_resolution_key)
         )
-        fps = max(resolutions[resolution])
+        fps = resolutions[resolution]
         return fmt, resolution, fps
 
     return None, None, None
@@ -203,17 +284,17 @@ def build_ffmpeg_cmd(device, fmt, res, fps, cam_id, use_vaapi, use_rkmpp, use_v4
     hwaccel_args = []
 
     if use_vaapi:
-        if "vaapi" in AVAILABLE_HWACCELS:
+        if "vaapi" in list_available_hwaccels():
             hwaccel_args += ["-hwaccel", "vaapi", "-vaapi_device", "/dev/dri/renderD128"]
         encoder_args += ["-vf", "format=nv12,hwupload", "-c:v", "h264_vaapi"]
 
     elif use_rkmpp:
-        if ("rkmpp" in AVAILABLE_HWACCELS):
+        if ("rkmpp" in list_available_hwaccels()):
             hwaccel_args += ["-hwaccel", "rkmpp"]
         encoder_args += ["-pix_fmt", "nv12", "-c:v", "h264_rkmpp"]
 
     elif use_v4l2m2m:
-        if "v4l2m2m" in AVAILABLE_HWACCELS:
+        if "v4l2m2m" in list_available_hwaccels():
             hwaccel_args += ["-hwaccel", "v4l2m2m"]
         encoder_args += ["-pix_fmt", "yuv420p", "-c:v", "h264_v4l2m2m"]
 
@@ -227,6 +308,18 @@ def build_ffmpeg_cmd(device, fmt, res, fps, cam_id, use_vaapi, use_rkmpp, use_v4
     return " ".join(cmd)
 
 
+# Parse command-line options
+parser = argparse.ArgumentParser(description="Regenerate the paths section of mediamtx.yml")
+parser.add_argument(
+    "--deep-probe", action="store_true",
+    help="validate hardware encoders with real test encodes instead of trusting the encoder list"
+)
+parser.add_argument(
+    "--no-cache", action="store_true",
+    help="always re-run v4l2-ctl instead of using cached probe results"
+)
+args = parser.parse_args()
+
 # Load, modify, and save mediamtx config
 yaml = YAML()
 yaml.preserve_quotes = True
@@ -252,17 +345,56 @@ use_vaapi = has_vaapi_encoder()
 use_rkmpp = has_rkmpp_encoder()
 use_v4l2m2m = has_v4l2m2m_encoder()
 
+# Optionally verify that detected encoders really initialize (driver
+# present, libva/MPP OK) rather than trusting the encoder list
+if args.deep_probe:
+    wanted = [name for name, flag in
+              (("vaapi", use_vaapi), ("rkmpp", use_rkmpp), ("v4l2m2m", use_v4l2m2m))
+              if flag]
+    probed = deep_probe_all(wanted)
+    use_vaapi = probed.get("vaapi", False)
+    use_rkmpp = probed.get("rkmpp", False)
+    use_v4l2m2m = probed.get("v4l2m2m", False)
+
 # Clear camera-specific entries (preserving all_others)
 all_others = config["paths"].pop("all_others", {})
 
-# Autodetect and configure each /dev/video* device
-for dev in list_video_devices():
-    match = re.search(r"video(\d+)", dev)
-    if not match:
-        continue
-    cam_id = f"cam{match.group(1)}"
+# Autodetect and configure each /dev/video* device.
+# Cached probe results are reused while fresh; only misses fork v4l2-ctl.
+# Probes are independent and I/O-bound, so fan them out across threads
+# (subprocess waits release the GIL) instead of forking v4l2-ctl serially.
+devices = list_video_devices()
+cache = {} if args.no_cache else load_v4l2_cache()
+cache_keys = [None if args.no_cache else v4l2_cache_key(dev) for dev in devices]
+cache_dirty = False
+now = time.time()
+
+raw_outputs = [None] * len(devices)
+misses = []
+for i, key in enumerate(cache_keys):
+    entry = cache.get(key) if key else None
+    if entry and now - entry.get("ts", 0) < CACHE_TTL:
+        raw_outputs[i] = entry["raw"]
+    else:
+        misses.append(i)
+
+if misses:
+    with ThreadPoolExecutor(max_workers=min(8, len(misses))) as executor:
+        for i, raw in zip(misses, executor.map(run_v4l2ctl, [devices[i] for i in misses])):
+            raw_outputs[i] = raw
+            if raw and cache_keys[i]:
+                cache[cache_keys[i]] = {"raw": raw, "ts": now}
+                cache_dirty = True
+
+if cache_dirty:
+    save_v4l2_cache(cache)
+
+cam_paths = {}  # cam_id → RTSP URL, mirrored into the JSON sidecar
+
+for dev, raw in zip(devices, raw_outputs):
+    # list_video_devices guarantees a /dev/video<N> path
+    cam_id = f"cam{dev[len('/dev/video'):]}"
 
-    raw = run_v4l2ctl(dev)
     if not raw:
         continue
 
@@ -276,12 +408,37 @@ for dev in list_video_devices():
         "runOnInit": build_ffmpeg_cmd(dev, fmt, res, fps, cam_id, use_vaapi, use_rkmpp, use_v4l2m2m),
         "runOnInitRestart": "yes"
     }
+    cam_paths[cam_id] = f"rtsp://localhost:8554/{cam_id}"
 
 # Reattach all_others
 config["paths"]["all_others"] = all_others
 
-# Write updated config to disk
-with CONFIG_PATH.open("w") as f:
-    yaml.dump(config, f)
-
-print(f"✅ mediamtx.yml updated (VAAPI: {'yes' if use_vaapi else 'no'})")
+# Publish the cam→RTSP map as a JSON sidecar so snapfeeder can start
+# without parsing YAML at all
+sidecar_text = json.dumps(cam_paths, indent=2, sort_keys=True) + "\n"
+try:
+    sidecar_stale = SIDECAR_PATH.read_text() != sidecar_text
+except OSError:
+    sidecar_stale = True
+if sidecar_stale:
+    SIDECAR_PATH.write_text(sidecar_text)
+
+# Render the updated config and write only if it actually changed, so
+# idempotent reruns don't bump the mtime and trigger MediaMTX reloads
+buf = StringIO()
+yaml.dump(config, buf)
+new_text = buf.getvalue()
+
+try:
+    old_text = CONFIG_PATH.read_text()
+except OSError:
+    old_text = None
+
+if new_text == old_text:
+    print("✅ mediamtx.yml unchanged")
+else:
+    # Atomic replace so a kill mid-write never leaves half a config
+    tmp_path = CONFIG_PATH.with_suffix(".yml.tmp")
+    tmp_path.write_text(new_text)
+    os.replace(tmp_path, CONFIG_PATH)
+    print(f"✅ mediamtx.yml updated (VAAPI: {'yes' if use_vaapi else 'no'})")
@@ -14,41 +14,127 @@ This server:
 - One snapshot endpoint per camera: /cam0.jpg, /cam1.jpg, etc.
 
 Dependencies:
-- ruamel.yaml, flask, av, turbojpeg, ffmpeg
+- ruamel.yaml, flask, waitress, av, turbojpeg, ffmpeg
 """
 
+import argparse
+import fcntl
+import json
 import os
 import re
 import sys
 import av
+import numpy as np
 import time
 import signal
 import threading
 import subprocess
 from ruamel.yaml import YAML
-from flask import Flask, Response, send_file
-from io import BytesIO
-from turbojpeg import TurboJPEG
+from flask import Flask, request
+from turbojpeg import TurboJPEG, TJSAMP_420, TJSAMP_422, TJSAMP_444
+try:
+    from turbojpeg import TJFLAG_FASTDCT
+except ImportError:  # older PyTurboJPEG without flag constants
+    TJFLAG_FASTDCT = 0
 from pathlib import Path
 
 # Configuration file path: ../mediamtx/mediamtx.yml
 CONFIG_PATH = Path(__file__).resolve().parent.parent / "mediamtx" / "mediamtx.yml"
+# JSON sidecar with {cam_id: rtsp_url}, written by generate_mediamtx_config.py
+SIDECAR_PATH = CONFIG_PATH.parent / "mediamtx_paths.json"
+
+# Precompiled pattern for RTSP URLs inside runOnInit commands
+_RTSP_RE = re.compile(r'rtsp://[^\s\'"]+')
 
 # Flask app and runtime data
 app = Flask(__name__)
 CAMERAS = {}  # cam name → stream info
-JPEG_ENCODER = TurboJPEG()
+
+# TurboJPEG handles are not documented as safe for concurrent encode()
+# calls, so each encoder thread gets its own instance via thread-local
+# storage — encodes for different cameras then run truly in parallel.
+_TLS = threading.local()
+
+def jpeg_encoder():
+    """Returns this thread's TurboJPEG instance, creating it on first use."""
+    encoder = getattr(_TLS, 'encoder', None)
+    if encoder is None:
+        encoder = _TLS.encoder = TurboJPEG()
+    return encoder
+
+# Snapshot quality: 85 is visually near-lossless, while quality 100 makes
+# libjpeg-turbo spend most of its time on the last few quality points.
+# Both are overridable from the command line (--quality / --subsample).
+JPEG_QUALITY = 85
+JPEG_SUBSAMPLE = TJSAMP_420
+SUBSAMPLE_BY_NAME = {"420": TJSAMP_420, "422": TJSAMP_422, "444": TJSAMP_444}
+
+def warm_up_encoder():
+    """
+    Throwaway 64x64 encode: the first encode on a thread pays for loading
+    the SIMD code paths and allocating libjpeg-turbo's internal scratch
+    buffers, so each encoder thread runs this once before real frames
+    arrive (resolution-specific scratch is then warmed by the first
+    decoded frame).
+    """
+    try:
+        jpeg_encoder().encode_from_yuv(
+            np.zeros(64 * 64 * 3 // 2, np.uint8), 64, 64,
+            quality=JPEG_QUALITY, jpeg_subsample=JPEG_SUBSAMPLE,
+            flags=TJFLAG_FASTDCT, align=1
+        )
+    except Exception:
+        pass
+
+def camera_entry(rtsp_url):
+    """Builds the runtime-state dict for one camera."""
+    return {
+        'source': rtsp_url,
+        'container': None,
+        'process': None,
+        'latest_yuv': None,    # yuv420p ndarray published by the capture thread
+        'frame_size': None,    # (width, height) of latest_yuv
+        'slots': None,         # small ring of preallocated YUV buffers
+        'write_idx': -1,       # ring slot the capture thread last filled
+        # (seq, bytes) stored as one tuple so readers can never pair a
+        # JPEG with another frame's sequence; seq is None for passthrough
+        'latest_jpeg': None,
+        'vaapi_failed': False,  # latched True when the GPU encode path dies
+        'passthrough': False,  # True once the source is known to be MJPEG
+        'frame_seq': 0,        # bumped by the capture thread per new frame
+        'jpeg_seq': -1,        # encoder-private: last frame_seq it encoded
+        'new_frame': threading.Event(),  # capture → encoder thread signal
+        'jpeg_ready': threading.Event(), # a fresh JPEG landed in latest_jpeg
+        # One reformatter per camera: libswscale keeps a single context
+        # alive across frames and reconnects instead of rebuilding it.
+        'reformatter': av.video.reformatter.VideoReformatter(),
+        'last_request_ts': 0.0  # monotonic time of the last snapshot request
+    }
 
 # Parse MediaMTX config and extract camera definitions
 def parse_mediamtx_config():
     """
-    Reads mediamtx.yml and collects all RTSP camera entries
-    with source: publisher and a valid RTSP URL in runOnInit.
+    Collects all RTSP camera entries. Prefers the JSON sidecar written by
+    the config generator (no YAML parsing at all); falls back to scanning
+    mediamtx.yml for source: publisher paths with an RTSP URL in runOnInit.
     """
+    try:
+        with open(SIDECAR_PATH, 'r') as f:
+            cam_paths = json.load(f)
+    except Exception:
+        cam_paths = None
+
+    if cam_paths:
+        for name, rtsp_url in cam_paths.items():
+            CAMERAS[name] = camera_entry(rtsp_url)
+        return
+
     if not CONFIG_PATH.exists():
         raise FileNotFoundError(f"❌ Config file not found: {CONFIG_PATH}")
-    
-    yaml = YAML()
+
+    # Safe (non-round-trip) loader: snapfeeder only reads the config, so
+    # there is no need for ruamel's slow comment/quote-preserving mode.
+    yaml = YAML(typ='safe', pure=False)
     with open(CONFIG_PATH, 'r') as f:
         config = yaml.load(f)
 
@@ -59,37 +145,270 @@ def parse_mediamtx_config():
         if entry.get('source') != 'publisher':
             continue
         run_init = entry.get('runOnInit', '')
-        rtsp_match = re.search(r'rtsp://[^\s\'"]+', run_init)
+        rtsp_match = _RTSP_RE.search(run_init)
         if rtsp_match:
-            rtsp_url = rtsp_match.group(0)
-            CAMERAS[name] = {
-                'source': rtsp_url,
-                'container': None,
-                'process': None,
-                'latest_frame': None,
-                'latest_jpeg': None
-            }
+            CAMERAS[name] = camera_entry(rtsp_match.group(0))
+
+# Optional ffmpeg-based grabber (SNAPFEEDER_FFMPEG_GRAB=1): one ffmpeg
+# process per camera emits a low-rate MJPEG stream on stdout and we keep
+# the last complete JPEG. Skips PyAV decode and TurboJPEG entirely —
+# ffmpeg does SIMD-optimized JPEG encoding natively.
+FFMPEG_GRAB = bool(os.environ.get("SNAPFEEDER_FFMPEG_GRAB"))
+FFMPEG_GRAB_FPS = 5
+
+def ffmpeg_has_vaapi():
+    """Checks whether ffmpeg lists vaapi among its hwaccels."""
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-hwaccels"],
+            capture_output=True, text=True
+        )
+        return "vaapi" in result.stdout.split()
+    except Exception:
+        return False
+
+def ffmpeg_capture_loop(name):
+    """
+    Spawns ffmpeg to pull the RTSP stream and emit MJPEG frames on stdout;
+    scans for SOI/EOI markers and stores the last complete JPEG.
+    """
+    cam = CAMERAS[name]
+    retry_delay = 5
+
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error"]
+    if ffmpeg_has_vaapi():
+        cmd += ["-hwaccel", "vaapi"]
+    cmd += [
+        "-rtsp_transport", "tcp", "-i", cam['source'],
+        "-vf", f"fps={FFMPEG_GRAB_FPS}",
+        "-c:v", "mjpeg", "-q:v", "3",
+        # Raw MJPEG elementary stream: back-to-back SOI..EOI images with
+        # no container framing for the marker scanner to wade through.
+        "-f", "mjpeg", "-"
+    ]
+
+    while True:
+        proc = None
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            cam['process'] = proc
+            cam['passthrough'] = True
+
+            # Grow the pipe from the 64 KiB default so ffmpeg can write a
+            # whole frame without blocking and we wake up for fewer, larger
+            # reads. Best effort — needs fcntl.F_SETPIPE_SZ (Linux) and may
+            # be capped by /proc/sys/fs/pipe-max-size.
+            try:
+                fcntl.fcntl(proc.stdout.fileno(), fcntl.F_SETPIPE_SZ, 1 << 20)
+            except (AttributeError, OSError):
+                pass
+
+            buf = b""
+            while True:
+                # read1: take whatever the pipe has in one syscall —
+                # read() would block until the full 128 KiB accumulated,
+                # serving frames a few hundred ms stale at grabber rates.
+                chunk = proc.stdout.read1(1 << 17)
+                if not chunk:
+                    break
+                buf += chunk
+                # Keep only the last complete SOI..EOI JPEG in the buffer
+                end = buf.rfind(b'\xff\xd9')
+                if end != -1:
+                    start = buf.rfind(b'\xff\xd8', 0, end)
+                    if start != -1:
+                        cam['latest_jpeg'] = (None, buf[start:end + 2])
+                        cam['jpeg_ready'].set()
+                    buf = buf[end + 2:]
+
+            print(f"[{name}] ffmpeg exited, retrying in {retry_delay}s...")
+        except Exception as e:
+            print(f"[{name}] Capture error: {e}, retrying in {retry_delay}s...")
+        finally:
+            if proc and proc.poll() is None:
+                proc.kill()
+            cam['process'] = None
+        time.sleep(retry_delay)
+
+def publish_yuv(cam, vf):
+    """
+    Packs a yuv420p frame's planes into the next slot of the camera's
+    small ring of preallocated buffers (stripping per-line padding) and
+    returns that slot. Rotating three slots means a reader holding the
+    most recently published array is never racing the writer, which is
+    already filling a different slot — without any per-frame allocation.
+    """
+    width, height = vf.width, vf.height
+    size = width * height * 3 // 2
+    slots = cam['slots']
+    if slots is None or slots[0].size != size:
+        slots = cam['slots'] = [np.empty(size, np.uint8) for _ in range(3)]
+        cam['write_idx'] = -1
+
+    idx = (cam['write_idx'] + 1) % len(slots)
+    buf = slots[idx]
+
+    offset = 0
+    for plane, pw, ph in zip(vf.planes,
+                             (width, width // 2, width // 2),
+                             (height, height // 2, height // 2)):
+        count = pw * ph
+        src = np.frombuffer(plane, np.uint8)
+        if plane.line_size == pw:
+            buf[offset:offset + count] = src[:count]
+        else:
+            buf[offset:offset + count] = src.reshape(ph, plane.line_size)[:, :pw].ravel()
+        offset += count
+
+    cam['write_idx'] = idx
+    return buf
+
+def pin_to_core(index):
+    """
+    Pins the calling thread to a single core (modulo the core count) so
+    its SIMD working set stays cache-resident instead of bouncing between
+    cores. No-op on platforms without sched_setaffinity.
+    """
+    if not hasattr(os, 'sched_setaffinity'):
+        return
+    try:
+        os.sched_setaffinity(0, {index % (os.cpu_count() or 1)})
+    except OSError:
+        pass
+
+# Bound simultaneous decode work across capture threads. The threads
+# spend most of their time blocked in demux (PyAV offers no non-blocking
+# I/O, so one thread per camera stays), but on a 16-camera rig the
+# decode bursts would otherwise contend for every core at once.
+DECODE_SLOTS = threading.BoundedSemaphore(max(2, os.cpu_count() or 2))
+
+# With no snapshot request for this long, only keyframes get decoded.
+# Dropping P-frames for idle cameras cuts decode CPU by the GOP ratio;
+# after wake-up decode stays keyframe-only until the next keyframe, so
+# the first frame served may be up to one GOP old but never corrupt.
+IDLE_SKIP_S = 2
+
+def should_skip(cam, packet, resync):
+    """
+    True when this packet must not be decoded. Idle cameras decode only
+    keyframes; once anything was skipped, the decoder is missing the
+    reference frames that later P-frames predict from, so `resync` (a
+    one-element mutable flag) keeps non-keyframes skipped — even after a
+    request wakes the camera — until the next keyframe restores a clean
+    decode state.
+    """
+    if packet.is_keyframe:
+        resync[0] = False
+        return False
+    if resync[0] or time.monotonic() - cam['last_request_ts'] > IDLE_SKIP_S:
+        resync[0] = True
+        return True
+    return False
+
+def hw_h264_decoder(stream):
+    """
+    Returns a V4L2 M2M (VPU) decoder context for an H.264 stream when the
+    ffmpeg build offers one (e.g. Raspberry Pi), or None to stay on the
+    software decoder. Hardware decode cuts the dominant CPU cost of
+    high-resolution RTSP capture.
+    """
+    if stream.codec_context.name != 'h264':
+        return None
+    if 'h264_v4l2m2m' not in av.codecs_available:
+        return None
+    try:
+        decoder = av.CodecContext.create('h264_v4l2m2m', 'r')
+        if stream.codec_context.extradata:
+            decoder.extradata = stream.codec_context.extradata
+        return decoder
+    except Exception:
+        return None
 
 # PyAV capture thread for a specific camera
 def capture_loop(name):
     """
-    Directly connects to the RTSP stream using PyAV and stores the latest raw frame.
-    JPEG encoding happens only on-demand during HTTP request.
+    Directly connects to the RTSP stream using PyAV and publishes the
+    latest frame as a yuv420p ndarray. JPEG encoding happens only
+    on-demand during HTTP request.
     """
     cam = CAMERAS[name]
     retry_delay = 5
+    pin_to_core(list(CAMERAS).index(name))
+
+    # Hardware decoder context persists across reconnects: the stream's
+    # parameters don't change when ffmpeg or the camera drops the
+    # connection, so reopening only the container skips the VPU probe
+    # and context allocation on every retry.
+    decoder = None
 
     while True:
         try:
+            # Direct RTSP open — no ffmpeg remux subprocess or pipe copy in
+            # between — with low-delay flags so libavformat doesn't buffer
+            # or probe more of the stream than a live snapshot needs.
             container = av.open(
                 cam['source'],
-                options={"rtsp_transport": "tcp", "stimeout": "2000000"}  # 2s timeout
+                options={
+                    "rtsp_transport": "tcp",
+                    "stimeout": "2000000",  # 2s socket timeout
+                    "fflags": "nobuffer",
+                    "flags": "low_delay",
+                    "probesize": "32",
+                    "analyzeduration": "0"
+                },
+                timeout=5
             )
             cam['container'] = container
 
-            for frame in container.decode(video=0):
-                cam['latest_frame'] = frame
-                cam['latest_jpeg'] = None
+            if container.streams.video[0].codec_context.name == 'mjpeg':
+                # Source already carries JPEG bitstreams: keep the latest
+                # packet verbatim — no decode, and no re-encode on request.
+                cam['passthrough'] = True
+                for packet in container.demux(video=0):
+                    if packet.size:
+                        cam['latest_jpeg'] = (None, bytes(packet))
+                        cam['jpeg_ready'].set()
+            else:
+                cam['passthrough'] = False
+
+                def publish(frame):
+                    # Convert on the decoder thread: requests then read a
+                    # plain ndarray and never race the short-lived
+                    # VideoFrame owned by this loop. Decoded H.264 is
+                    # normally yuv420p already — pack its planes directly
+                    # and keep the reformatter for other pixel formats.
+                    if frame.format.name == 'yuv420p':
+                        vf = frame
+                    else:
+                        vf = cam['reformatter'].reformat(frame, format='yuv420p')
+                    cam['frame_size'] = (vf.width, vf.height)
+                    cam['latest_yuv'] = publish_yuv(cam, vf)
+                    # Single-writer bump, then wake the encoder thread
+                    cam['frame_seq'] += 1
+                    cam['new_frame'].set()
+
+                if decoder is None:
+                    decoder = hw_h264_decoder(container.streams.video[0])
+                # Fresh connections start on a keyframe, so the decoder
+                # is in sync until idle skipping drops a packet.
+                resync = [False]
+                if decoder is not None:
+                    # VPU-backed decode: feed demuxed packets straight to
+                    # the V4L2 M2M codec context instead of letting the
+                    # container run the software decoder.
+                    for packet in container.demux(video=0):
+                        if should_skip(cam, packet, resync):
+                            continue
+                        with DECODE_SLOTS:
+                            for frame in decoder.decode(packet):
+                                publish(frame)
+                else:
+                    for packet in container.demux(video=0):
+                        if should_skip(cam, packet, resync):
+                            continue
+                        with DECODE_SLOTS:
+                            for frame in packet.decode():
+                                publish(frame)
 
         except av.AVError as e:
             print(f"[{name}] AVError: {e}, retrying in {retry_delay}s...")
@@ -99,6 +418,162 @@ def capture_loop(name):
             time.sleep(retry_delay)
 
 
+# GPU JPEG encoding: when ffmpeg has a working mjpeg_vaapi encoder,
+# snapshots are encoded on the iGPU through a persistent rawvideo→JPEG
+# pipe instead of libjpeg-turbo on the CPU. Falls back to TurboJPEG on
+# any pipe failure.
+def ffmpeg_has_encoder(encoder):
+    """Checks whether ffmpeg lists the given video encoder."""
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            capture_output=True, text=True
+        )
+        return any(
+            line.startswith(" V") and line.split()[1:2] == [encoder]
+            for line in result.stdout.splitlines()
+        )
+    except Exception:
+        return False
+
+def vaapi_jpeg_works():
+    """
+    Validates mjpeg_vaapi with a one-frame test encode, like the config
+    generator's --deep-probe: stock Debian/Raspberry Pi OS ffmpeg builds
+    list VAAPI encoders even when no working /dev/dri device exists, and
+    the listing alone says nothing about driver init succeeding.
+    """
+    if not ffmpeg_has_encoder("mjpeg_vaapi"):
+        return False
+    try:
+        return subprocess.run([
+            "ffmpeg", "-hide_banner",
+            "-f", "lavfi", "-i", "testsrc2=size=128x128:rate=5",
+            "-frames:v", "1",
+            "-vaapi_device", "/dev/dri/renderD128",
+            "-vf", "format=nv12,hwupload",
+            "-c:v", "mjpeg_vaapi", "-f", "null", "-"
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+    except Exception:
+        return False
+
+USE_VAAPI_JPEG = vaapi_jpeg_works()
+
+def vaapi_jpeg_encode(cam, yuv, width, height):
+    """
+    Encodes one published yuv420p frame to JPEG via a per-camera
+    persistent mjpeg_vaapi ffmpeg pipe (raw YUV in on stdin, JPEG out on
+    stdout).
+    """
+    proc = cam.get('vaapi_proc')
+    size = (width, height)
+    if proc is None or cam.get('vaapi_size') != size or proc.poll() is not None:
+        if proc and proc.poll() is None:
+            proc.kill()
+        proc = subprocess.Popen([
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-vaapi_device", "/dev/dri/renderD128",
+            "-f", "rawvideo", "-pix_fmt", "yuv420p",
+            "-s", f"{width}x{height}", "-i", "-",
+            "-vf", "format=nv12,hwupload", "-c:v", "mjpeg_vaapi",
+            "-f", "image2pipe", "-flush_packets", "1", "-"
+        ], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        cam['vaapi_proc'] = proc
+        cam['vaapi_size'] = size
+
+    proc.stdin.write(yuv.tobytes())
+    proc.stdin.flush()
+
+    buf = b""
+    while True:
+        chunk = proc.stdout.read1(65536)
+        if not chunk:
+            raise RuntimeError("mjpeg_vaapi pipe closed")
+        buf += chunk
+        end = buf.find(b'\xff\xd9')
+        if end != -1:
+            return buf[:end + 2]
+
+# Per-camera encoder thread: re-encodes the latest published frame
+# whenever the capture thread signals one, so HTTP requests only ever
+# copy ready bytes instead of running TurboJPEG in the request handler.
+def encoder_loop(name):
+    cam = CAMERAS[name]
+    # Offset by one so the encoder lands on a different core than the
+    # camera's own capture thread
+    pin_to_core(list(CAMERAS).index(name) + 1)
+    warm_up_encoder()
+    while True:
+        cam['new_frame'].wait()
+        cam['new_frame'].clear()
+
+        seq = cam['frame_seq']
+        yuv = cam['latest_yuv']
+        if yuv is None or cam['jpeg_seq'] == seq:
+            continue
+        width, height = cam['frame_size']
+
+        try:
+            jpeg_buf = None
+            if USE_VAAPI_JPEG and not cam['vaapi_failed']:
+                try:
+                    jpeg_buf = vaapi_jpeg_encode(cam, yuv, width, height)
+                except Exception:
+                    # GPU path broke at runtime — latch it off for this
+                    # camera rather than respawning ffmpeg every frame.
+                    cam['vaapi_failed'] = True
+                    jpeg_buf = None
+
+            if jpeg_buf is None:
+                # Frames are published as planar YUV already — encode
+                # directly, no colorspace conversion. Fast DCT: at
+                # quality 85 the accuracy loss is invisible and the fast
+                # integer path is noticeably quicker on ARM. TurboJPEG
+                # emits baseline (non-progressive) JPEG by default, which
+                # is the fully SIMD-optimized path.
+                # align=1: publish_yuv packs the planes tightly, while
+                # PyTurboJPEG defaults to 4-byte row alignment and would
+                # reject odd widths whose chroma rows aren't 4-aligned.
+                jpeg_buf = jpeg_encoder().encode_from_yuv(
+                    yuv, height, width,
+                    quality=JPEG_QUALITY, jpeg_subsample=JPEG_SUBSAMPLE,
+                    flags=TJFLAG_FASTDCT, align=1
+                )
+            cam['latest_jpeg'] = (seq, jpeg_buf)
+            cam['jpeg_seq'] = seq
+            cam['jpeg_ready'].set()
+        except Exception as e:
+            print(f"[{name}] Encode error: {e}")
+            time.sleep(1)
+
+# Build a JPEG response straight from a bytes object — no BytesIO or
+# send_file machinery. When an ETag is supplied, matching If-None-Match
+# requests short-circuit to an empty 304 instead of resending the image.
+def jpeg_response(jpeg_buf, etag=None):
+    if etag is not None:
+        if request.if_none_match and etag in request.if_none_match:
+            return app.response_class(status=304, headers={
+                'ETag': f'"{etag}"',
+                'Cache-Control': 'no-cache'
+            })
+        return app.response_class(
+            jpeg_buf,
+            mimetype='image/jpeg',
+            headers={
+                'Content-Length': str(len(jpeg_buf)),
+                'ETag': f'"{etag}"',
+                'Cache-Control': 'no-cache'
+            }
+        )
+    return app.response_class(
+        jpeg_buf,
+        mimetype='image/jpeg',
+        headers={
+            'Content-Length': str(len(jpeg_buf)),
+            'Cache-Control': 'no-store'
+        }
+    )
+
 # Flask view to return JPEG snapshot from camera
 def serve_snapshot(name):
     """
@@ -110,37 +585,99 @@ def serve_snapshot(name):
     if not cam:
         return "Camera not found", 404
 
-    frame = cam.get('latest_frame')
-    if frame is None:
+    cam['last_request_ts'] = time.monotonic()
+
+    # Both paths publish ready-to-serve (seq, bytes) tuples: the capture
+    # thread for MJPEG passthrough (seq None), the encoder thread for
+    # decoded sources. One read keeps the ETag paired with its bytes.
+    entry = cam['latest_jpeg']
+    if entry is None:
         return "Frame not ready", 503
 
-    if cam['latest_jpeg']:
-        return send_file(BytesIO(cam['latest_jpeg']), mimetype='image/jpeg')
+    seq, jpeg_buf = entry
+    if seq is None:
+        return jpeg_response(jpeg_buf)
+    return jpeg_response(jpeg_buf, etag=f"{name}-{seq}")
 
-    try:
-        jpeg_buf = JPEG_ENCODER.encode(frame.to_ndarray(format='bgr24'), quality=100, pixel_format=1)
-        cam['latest_jpeg'] = jpeg_buf
-        return send_file(BytesIO(jpeg_buf), mimetype='image/jpeg')
-    except Exception as e:
-        return f"Encoding error: {e}", 500
+# Flask view streaming MJPEG at the camera's native rate
+def serve_mjpeg(name):
+    """
+    Streams multipart/x-mixed-replace MJPEG built from the same JPEG
+    buffers the snapshot endpoint serves — any number of viewers share
+    one capture and one encoder thread per camera.
+    """
+    cam = CAMERAS.get(name)
+    if not cam:
+        return "Camera not found", 404
+
+    def generate():
+        while True:
+            # Keep the idle keyframe-skip from kicking in while streaming
+            cam['last_request_ts'] = time.monotonic()
+            if not cam['jpeg_ready'].wait(timeout=5):
+                continue
+            cam['jpeg_ready'].clear()
+            entry = cam['latest_jpeg']
+            if entry is None:
+                continue
+            jpeg_buf = entry[1]
+            yield (b'--FRAME\r\n'
+                   b'Content-Type: image/jpeg\r\n'
+                   + f'Content-Length: {len(jpeg_buf)}\r\n\r\n'.encode()
+                   + jpeg_buf + b'\r\n')
+
+    return app.response_class(
+        generate(),
+        mimetype='multipart/x-mixed-replace; boundary=FRAME'
+    )
 
 # Graceful shutdown: stop all ffmpeg processes
 def cleanup():
     for cam in CAMERAS.values():
-        proc = cam.get('process')
-        if proc:
-            proc.send_signal(signal.SIGTERM)
+        container = cam.get('container')
+        if container:
             try:
-                proc.wait(timeout=2)
-            except subprocess.TimeoutExpired:
-                proc.kill()
+                container.close()
+            except Exception:
+                pass
+        for key in ('process', 'vaapi_proc'):
+            proc = cam.get(key)
+            if proc:
+                proc.send_signal(signal.SIGTERM)
+                try:
+                    proc.wait(timeout=2)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
 
-# Register Flask route
+# Register Flask routes
 app.add_url_rule('/<name>.jpg', view_func=serve_snapshot)
+app.add_url_rule('/<name>.mjpg', view_func=serve_mjpeg)
 
 # Main entrypoint
 if __name__ == '__main__':
     import atexit
+
+    parser = argparse.ArgumentParser(description="JPEG snapshot server for MediaMTX RTSP streams")
+    parser.add_argument(
+        "--quality", type=int, default=JPEG_QUALITY,
+        help=f"JPEG quality for encoded snapshots, 1-100 (default {JPEG_QUALITY})"
+    )
+    parser.add_argument(
+        "--subsample", choices=sorted(SUBSAMPLE_BY_NAME), default="420",
+        help="JPEG chroma subsampling (default 420)"
+    )
+    parser.add_argument(
+        "--dev", action="store_true",
+        help="run the Werkzeug dev server instead of waitress"
+    )
+    parser.add_argument(
+        "--threads", type=int, default=16,
+        help="waitress worker threads (default 16)"
+    )
+    cli_args = parser.parse_args()
+    JPEG_QUALITY = cli_args.quality
+    JPEG_SUBSAMPLE = SUBSAMPLE_BY_NAME[cli_args.subsample]
+
     try:
         parse_mediamtx_config()
     except Exception as e:
@@ -151,10 +688,26 @@ if __name__ == '__main__':
         print("No RTSP publishers found in mediamtx.yml.")
         sys.exit(1)
 
+    grab_loop = ffmpeg_capture_loop if FFMPEG_GRAB else capture_loop
     for name in CAMERAS:
-        t = threading.Thread(target=capture_loop, args=(name,), daemon=True)
+        t = threading.Thread(target=grab_loop, args=(name,), daemon=True)
         t.start()
+        if not FFMPEG_GRAB:
+            # Encoder thread for decoded sources; never signalled (and so
+            # never runs) when the camera turns out to be MJPEG
+            e = threading.Thread(target=encoder_loop, args=(name,), daemon=True)
+            e.start()
 
     atexit.register(cleanup)
     time.sleep(1)
-    app.run(host='0.0.0.0', port=5050)
+
+    if cli_args.dev or os.environ.get("DEV"):
+        # Werkzeug dev server for local debugging only
+        app.run(host='0.0.0.0', port=5050)
+    else:
+        # Threaded production server: responses are plain bytes objects
+        # handed straight to the socket, and TurboJPEG releases the GIL,
+        # so concurrent snapshot requests really run in parallel.
+        from waitress import serve
+        serve(app, host='0.0.0.0', port=5050,
+              threads=cli_args.threads, connection_limit=256)